@@ -3,13 +3,40 @@
 Script to automatically create a user and session in n8n database for automatic login.
 This ensures that when accessing the URL, the user is immediately logged in to the workspace.
 """
+import argparse
+import logging
 import os
+import random
+import re
 import sys
+import threading
 import time
 import uuid
-import bcrypt
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
 import psycopg2
+import psycopg2.errors
+from psycopg2 import sql
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+log = logging.getLogger('n8n_init')
+
+
+def env_int(name, default):
+    """Read an integer setting; None if it is not a valid integer.
+
+    Invalid values are reported by validate_config() instead of failing
+    at import with a bare ValueError.
+    """
+    try:
+        return int(os.getenv(name, default))
+    except ValueError:
+        return None
+
+
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
 
 # Database connection parameters
 DB_HOST = os.getenv('DB_POSTGRESDB_HOST', 'postgres')
@@ -17,12 +44,58 @@ DB_PORT = os.getenv('DB_POSTGRESDB_PORT', '5432')
 DB_NAME = os.getenv('DB_POSTGRESDB_DATABASE', 'n8n')
 DB_USER = os.getenv('DB_POSTGRESDB_USER', 'n8n')
 DB_PASSWORD = os.getenv('DB_POSTGRESDB_PASSWORD', 'n8n')
+DB_CONFIG = {
+    'host': DB_HOST,
+    'port': DB_PORT,
+    'database': DB_NAME,
+    'user': DB_USER,
+    'password': DB_PASSWORD,
+    # The shared connection stays open through the readiness waits; TCP
+    # keepalives stop idle-connection reaping by container networking and
+    # detect a dead peer in seconds instead of minutes
+    'keepalives': 1,
+    'keepalives_idle': 30,
+    'keepalives_interval': 10,
+    'keepalives_count': 3,
+    'tcp_user_timeout': 10000,
+}
 
 # Default user credentials
 DEFAULT_USER_EMAIL = os.getenv('N8N_DEFAULT_EMAIL', 'admin@n8n.local')
 DEFAULT_USER_PASSWORD = os.getenv('N8N_DEFAULT_PASSWORD', 'admin')
 DEFAULT_USER_FIRST_NAME = os.getenv('N8N_DEFAULT_FIRST_NAME', 'Admin')
 DEFAULT_USER_LAST_NAME = os.getenv('N8N_DEFAULT_LAST_NAME', 'User')
+# Optional precomputed bcrypt hash of N8N_DEFAULT_PASSWORD; skips hashing
+DEFAULT_USER_PASSWORD_HASH = os.getenv('N8N_DEFAULT_PASSWORD_HASH', '')
+# n8n hashes passwords with cost 10; more only slows down startup
+BCRYPT_ROUNDS = env_int('BCRYPT_ROUNDS', '10')
+
+# Static SQL, built once at import
+SCHEMA_TABLES_EXIST_SQL = """
+    SELECT to_regclass('public."user"') IS NOT NULL,
+           to_regclass('public.role') IS NOT NULL
+"""
+USER_ID_BY_EMAIL_SQL = 'SELECT id FROM "user" WHERE email = %s LIMIT 1'
+# Used as a value in the user INSERT, saving a separate role lookup
+ROLE_ID_BY_NAME_SUBQUERY = '(SELECT id FROM "role" WHERE name = %s LIMIT 1)'
+NOW_SQL = sql.SQL('NOW()')
+# Columns and values depend on the n8n schema version and are filled in
+# by create_or_get_user
+INSERT_USER_SQL = sql.SQL("""
+    INSERT INTO "user" ({columns}) VALUES ({values})
+    ON CONFLICT (email) DO NOTHING
+    RETURNING id
+""")
+# Read pg_attribute directly instead of the information_schema.columns
+# view; array_agg yields NULL when the table does not exist
+USER_COLUMNS_SQL = """
+    SELECT array_agg(attname::text ORDER BY attnum)
+    FROM pg_attribute
+    WHERE attrelid = to_regclass('public."user"')
+      AND attnum > 0 AND NOT attisdropped
+"""
+
+EMAIL_RE = re.compile(r'^[^@\s]+@[^@\s]+\.[^@\s]+$')
 
 # n8n API endpoint
 N8N_HOST = os.getenv('N8N_HOST', 'n8n')
@@ -30,102 +103,280 @@ N8N_PORT = os.getenv('N8N_PORT', '5678')
 N8N_PROTOCOL = os.getenv('N8N_PROTOCOL', 'http')
 N8N_BASE_URL = f"{N8N_PROTOCOL}://{N8N_HOST}:{N8N_PORT}"
 
-MAX_RETRIES = 30
-RETRY_DELAY = 2
+# Readiness waits: total time budget per dependency (seconds)
+DB_WAIT_TIMEOUT = 60
+SCHEMA_WAIT_TIMEOUT = 120
+ROLE_TABLE_WAIT_TIMEOUT = 60
+API_WAIT_TIMEOUT = 120
+
+# Exponential backoff between readiness probes (seconds)
+BACKOFF_BASE = 0.1
+BACKOFF_CAP = 2.0
+
+# Short connect timeout for readiness probes so a hung connect
+# does not eat into the wait budget
+DB_PROBE_TIMEOUT = 2
+# Upper bound for any single statement on the shared connection
+DB_STATEMENT_TIMEOUT = 10
+
+# Connection errors that retrying cannot fix (wrong credentials/database)
+FATAL_DB_ERROR_CODES = ('28000', '28P01', '3D000')
+FATAL_DB_ERROR_MESSAGES = (
+    'password authentication failed',
+    'no pg_hba.conf entry',
+    'does not exist',
+)
+
+# Session cookie cache. A cached cookie is always checked against n8n before
+# reuse, so the TTL only decides when to stop trying an old file and log in
+# afresh; an hour stays well inside n8n's default 168h session lifetime
+# (N8N_USER_MANAGEMENT_JWT_DURATION_HOURS).
+SESSION_COOKIE_FILE = os.getenv('N8N_SESSION_COOKIE_FILE', '/tmp/n8n_session_cookie.txt')
+SESSION_COOKIE_TTL = env_int('N8N_SESSION_COOKIE_TTL', '3600')
+
+
+def create_http_session():
+    """Create the HTTP session shared by all requests to n8n.
+
+    Health checks and login reuse one keep-alive connection instead of
+    opening a new TCP connection per request. Gateway errors while n8n
+    is (re)starting behind a proxy are retried a couple of times;
+    connection errors are left to the wait loops.
+    """
+    session = requests.Session()
+    session.headers['User-Agent'] = 'n8n-init/1.0'
+    retry = Retry(
+        total=2,
+        connect=0,
+        read=0,
+        status=2,
+        backoff_factor=0.3,
+        status_forcelist=(502, 503, 504),
+        allowed_methods=frozenset({'GET', 'POST'}),
+        raise_on_status=False
+    )
+    # Only one request is ever in flight: the health poll finishes before
+    # the login uses the session
+    adapter = HTTPAdapter(
+        pool_connections=1,
+        pool_maxsize=1,
+        max_retries=retry
+    )
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+HTTP_SESSION = create_http_session()
+
+# Set to stop wait_for_n8n_api early when main() gives up
+API_WAIT_CANCELLED = threading.Event()
+
+
+def backoff_delay(attempt):
+    """Return the delay before the next retry.
+
+    Grows exponentially from BACKOFF_BASE up to BACKOFF_CAP, with +/-20%
+    jitter so replicas started together do not poll in lockstep.
+    """
+    delay = min(BACKOFF_CAP, BACKOFF_BASE * (2 ** attempt))
+    return delay * random.uniform(0.8, 1.2)
+
+
+def log_level():
+    """Return the numeric level for LOG_LEVEL, or None if it is unknown."""
+    level = logging.getLevelName(LOG_LEVEL)
+    return level if isinstance(level, int) else None
+
+
+def validate_config():
+    """Check the configuration before waiting on anything."""
+    valid = True
+    if not EMAIL_RE.match(DEFAULT_USER_EMAIL):
+        log.error("N8N_DEFAULT_EMAIL is not a valid email address: %r", DEFAULT_USER_EMAIL)
+        valid = False
+    if not DEFAULT_USER_PASSWORD:
+        log.error("N8N_DEFAULT_PASSWORD must not be empty")
+        valid = False
+    if log_level() is None:
+        log.error("LOG_LEVEL is not a valid log level: %r", LOG_LEVEL)
+        valid = False
+
+    # (variable, parsed value, minimum, maximum or None)
+    int_settings = (
+        ('BCRYPT_ROUNDS', BCRYPT_ROUNDS, 4, 31),
+        ('N8N_SESSION_COOKIE_TTL', SESSION_COOKIE_TTL, 0, None),
+    )
+    for name, value, minimum, maximum in int_settings:
+        if (value is None or value < minimum
+                or (maximum is not None and value > maximum)):
+            if maximum is None:
+                expected = f"an integer of at least {minimum}"
+            else:
+                expected = f"an integer between {minimum} and {maximum}"
+            log.error("%s must be %s, got %r", name, expected, os.getenv(name))
+            valid = False
+    return valid
+
+
+def is_fatal_db_error(error):
+    """Tell whether a connection error will not go away by retrying."""
+    if error.pgcode in FATAL_DB_ERROR_CODES:
+        return True
+    # libpq reports startup failures without a SQLSTATE, so fall back to
+    # the server message
+    message = str(error)
+    return any(text in message for text in FATAL_DB_ERROR_MESSAGES)
 
 
 def wait_for_database():
-    """Wait for PostgreSQL to be ready."""
-    print("Waiting for PostgreSQL to be ready...")
-    for i in range(MAX_RETRIES):
+    """Wait for PostgreSQL to be ready and open the shared connection."""
+    log.info("Waiting for PostgreSQL to be ready...")
+    deadline = time.monotonic() + DB_WAIT_TIMEOUT
+    attempt = 0
+    while True:
         try:
-            conn = psycopg2.connect(
-                host=DB_HOST,
-                port=DB_PORT,
-                database=DB_NAME,
-                user=DB_USER,
-                password=DB_PASSWORD
-            )
-            conn.close()
-            print("PostgreSQL is ready!")
+            # Keep the successful connection for the following steps. A
+            # closed port fails immediately, and DB_PROBE_TIMEOUT bounds a
+            # hung connect.
+            get_db_connection()
+            log.info("PostgreSQL is ready!")
             return True
         except psycopg2.OperationalError as e:
-            if i < MAX_RETRIES - 1:
-                print(f"Waiting for database... (attempt {i+1}/{MAX_RETRIES})")
-                time.sleep(RETRY_DELAY)
-            else:
-                print(f"Failed to connect to database: {e}")
+            if is_fatal_db_error(e):
+                log.error("Database configuration error: %s", e)
                 return False
-    return False
+            if time.monotonic() >= deadline:
+                log.error("Failed to connect to database: %s", e)
+                return False
+            log.debug("Waiting for database... (attempt %d)", attempt + 1)
+            time.sleep(backoff_delay(attempt))
+            attempt += 1
+
+
+# Connection shared by the schema waits and user creation
+_db_conn = None
+
+
+def get_db_connection():
+    """Return the shared autocommit connection, opening it if needed.
+
+    Reusing one connection for every step avoids a full connect and
+    authentication handshake per query; a broken connection is replaced
+    transparently after close_db_connection().
+    """
+    global _db_conn
+    if _db_conn is None or _db_conn.closed:
+        _db_conn = psycopg2.connect(
+            **DB_CONFIG,
+            connect_timeout=DB_PROBE_TIMEOUT,
+            options=(f'-c statement_timeout={DB_STATEMENT_TIMEOUT * 1000} '
+                     '-c client_min_messages=warning')
+        )
+        _db_conn.autocommit = True
+    return _db_conn
+
+
+def close_db_connection():
+    """Close the shared connection so the next caller reconnects."""
+    global _db_conn
+    if _db_conn is not None:
+        try:
+            _db_conn.close()
+        except psycopg2.Error:
+            pass
+        _db_conn = None
+
+
+def get_user_table_columns(cur):
+    """Return the column names of the user table, or None if it is missing."""
+    cur.execute(USER_COLUMNS_SQL)
+    return cur.fetchone()[0]
+
+
+def find_column(columns_lower, *variants):
+    """Return the actual name of the first column matching one of variants.
+
+    columns_lower maps lower-cased column names to their real spelling;
+    variants are given in lower case.
+    """
+    for variant in variants:
+        if variant in columns_lower:
+            return columns_lower[variant]
+    return None
 
 
 def hash_password(password):
     """Hash password using bcrypt (n8n's default)."""
-    salt = bcrypt.gensalt()
+    # Imported here so runs with a precomputed hash never load bcrypt
+    import bcrypt
+    salt = bcrypt.gensalt(rounds=BCRYPT_ROUNDS)
     return bcrypt.hashpw(password.encode('utf-8'), salt).decode('utf-8')
 
 
+def has_precomputed_password_hash():
+    """Check whether N8N_DEFAULT_PASSWORD_HASH holds a usable bcrypt hash."""
+    return DEFAULT_USER_PASSWORD_HASH.startswith(('$2a$', '$2b$', '$2y$'))
+
+
+def get_password_hash():
+    """Return the owner's password hash.
+
+    Uses N8N_DEFAULT_PASSWORD_HASH when it is set to a bcrypt hash (which
+    must match N8N_DEFAULT_PASSWORD, as the API login still uses the plain
+    password), so the bcrypt cost is not paid at startup.
+    """
+    if has_precomputed_password_hash():
+        return DEFAULT_USER_PASSWORD_HASH
+    if DEFAULT_USER_PASSWORD_HASH:
+        log.warning("N8N_DEFAULT_PASSWORD_HASH is not a bcrypt hash, ignoring it")
+    return hash_password(DEFAULT_USER_PASSWORD)
+
+
 def create_or_get_user():
     """Create default user if it doesn't exist, or get existing user.
     
     Uses direct SQL INSERT to create owner account as described in the approach.
     Handles different n8n schema versions automatically.
+    The password is only hashed when the user has to be created.
     """
     try:
-        conn = psycopg2.connect(
-            host=DB_HOST,
-            port=DB_PORT,
-            database=DB_NAME,
-            user=DB_USER,
-            password=DB_PASSWORD
-        )
-        cur = conn.cursor()
-
-        # Check if user table exists
-        cur.execute("""
-            SELECT EXISTS (
-                SELECT FROM information_schema.tables 
-                WHERE table_name = 'user'
-            )
-        """)
-        if not cur.fetchone()[0]:
-            print("User table does not exist yet. Waiting for n8n to initialize...")
+        cur = get_db_connection().cursor()
+
+        # Check if user already exists. This is the common case on restarts,
+        # so it runs before (and usually instead of) the schema introspection.
+        try:
+            cur.execute(USER_ID_BY_EMAIL_SQL, (DEFAULT_USER_EMAIL,))
+        except psycopg2.errors.UndefinedTable:
+            log.info("User table does not exist yet. Waiting for n8n to initialize...")
             cur.close()
-            conn.close()
             return None
-
-        # Check if user already exists
-        cur.execute('SELECT id, email FROM "user" WHERE email = %s', (DEFAULT_USER_EMAIL,))
         existing_user = cur.fetchone()
         
         if existing_user:
             user_id = existing_user[0]
-            print(f"User '{DEFAULT_USER_EMAIL}' already exists (ID: {user_id})")
+            log.info("User '%s' already exists (ID: %s)", DEFAULT_USER_EMAIL, user_id)
             cur.close()
-            conn.close()
             return user_id
         
+        # Get available columns in user table
+        columns_raw = get_user_table_columns(cur)
+        if columns_raw is None:
+            # The lookup above found "user" through search_path, but the
+            # introspection only looks at the public schema
+            log.error('Table public."user" not found; check the search_path of database user %s',
+                      DB_USER)
+            cur.close()
+            return None
+
         # Create new user with hashed password
-        print(f"Creating owner user '{DEFAULT_USER_EMAIL}'...")
+        log.info("Creating owner user '%s'...", DEFAULT_USER_EMAIL)
         user_id = str(uuid.uuid4())
-        password_hash = hash_password(DEFAULT_USER_PASSWORD)
-        
-        # Get current timestamp
-        cur.execute("SELECT NOW()")
-        now = cur.fetchone()[0]
+        password_hash = get_password_hash()
         
-        # Get available columns in user table
-        cur.execute("""
-            SELECT column_name 
-            FROM information_schema.columns 
-            WHERE table_schema = 'public' AND table_name = 'user' 
-            ORDER BY ordinal_position
-        """)
-        columns_raw = [row[0] for row in cur.fetchall()]
         # Create case-insensitive lookup dictionary
         columns_lower = {col.lower(): col for col in columns_raw}
-        columns = set(columns_raw)  # Keep original for exact matching
-        print(f"Available columns in user table: {columns_raw}")
+        log.debug("Available columns in user table: %s", columns_raw)
         
         # Build INSERT statement - try simpler approach first, then fallback
         insert_cols = []
@@ -133,198 +384,208 @@ def create_or_get_user():
         placeholders = []
         
         # Required columns
-        if 'id' in columns or 'id' in columns_lower:
-            insert_cols.append('id')
+        if 'id' in columns_lower:
+            insert_cols.append(columns_lower['id'])
             insert_vals.append(user_id)
-            placeholders.append('%s')
+            placeholders.append(sql.Placeholder())
         
-        if 'email' in columns or 'email' in columns_lower:
-            insert_cols.append('email')
+        if 'email' in columns_lower:
+            insert_cols.append(columns_lower['email'])
             insert_vals.append(DEFAULT_USER_EMAIL)
-            placeholders.append('%s')
+            placeholders.append(sql.Placeholder())
         
-        if 'password' in columns or 'password' in columns_lower:
-            insert_cols.append('password')
+        if 'password' in columns_lower:
+            insert_cols.append(columns_lower['password'])
             insert_vals.append(password_hash)
-            placeholders.append('%s')
-        
-        # Name columns - case-insensitive search
-        first_name_col = None
-        for col_variant in ['firstname', 'first_name', 'firstname']:
-            if col_variant in columns_lower:
-                first_name_col = columns_lower[col_variant]
-                break
+            placeholders.append(sql.Placeholder())
         
-        # Also check for camelCase version
-        if not first_name_col:
-            for col in columns_raw:
-                if col.lower() == 'firstname' or col.lower() == 'first_name':
-                    first_name_col = col
-                    break
+        # Name columns - case-insensitive lookup
+        first_name_col = find_column(columns_lower, 'firstname', 'first_name')
         
         if first_name_col:
-            # Use quotes if camelCase (contains uppercase letters), otherwise use as-is
-            if first_name_col != first_name_col.lower():
-                insert_cols.append(f'"{first_name_col}"')
-            else:
-                insert_cols.append(first_name_col)
+            insert_cols.append(first_name_col)
             insert_vals.append(DEFAULT_USER_FIRST_NAME)
-            placeholders.append('%s')
-        
-        last_name_col = None
-        for col_variant in ['lastname', 'last_name', 'lastname']:
-            if col_variant in columns_lower:
-                last_name_col = columns_lower[col_variant]
-                break
+            placeholders.append(sql.Placeholder())
         
-        # Also check for camelCase version
-        if not last_name_col:
-            for col in columns_raw:
-                if col.lower() == 'lastname' or col.lower() == 'last_name':
-                    last_name_col = col
-                    break
+        last_name_col = find_column(columns_lower, 'lastname', 'last_name')
         
         if last_name_col:
-            # Use quotes if camelCase (contains uppercase letters), otherwise use as-is
-            if last_name_col != last_name_col.lower():
-                insert_cols.append(f'"{last_name_col}"')
-            else:
-                insert_cols.append(last_name_col)
+            insert_cols.append(last_name_col)
             insert_vals.append(DEFAULT_USER_LAST_NAME)
-            placeholders.append('%s')
+            placeholders.append(sql.Placeholder())
         
         # Role assignment - try different approaches (case-insensitive)
         role_col = None
+        global_role_col = find_column(columns_lower, 'globalroleid', 'global_role_id')
         # Approach 1: Direct 'role' column with 'global:owner' value (older n8n versions)
         if 'role' in columns_lower:
             role_col = columns_lower['role']
             insert_cols.append(role_col)
             insert_vals.append('global:owner')
-            placeholders.append('%s')
-            print("Using direct 'role' column with 'global:owner' value")
+            placeholders.append(sql.Placeholder())
+            log.info("Using direct 'role' column with 'global:owner' value")
         # Approach 2: globalRoleId with subquery to role table (newer n8n versions)
-        elif 'globalroleid' in columns_lower:
-            role_col = columns_lower['globalroleid']
-            # Use quotes if camelCase (contains uppercase letters)
-            if role_col != role_col.lower():
-                insert_cols.append(f'"{role_col}"')
-            else:
-                insert_cols.append(role_col)
-            # Get owner role ID from role table
-            cur.execute('SELECT id FROM "role" WHERE name = %s LIMIT 1', ('owner',))
-            role_result = cur.fetchone()
-            if role_result:
-                insert_vals.append(role_result[0])
-                placeholders.append('%s')
-                print(f"Using {role_col} with owner role ID: {role_result[0]}")
-            else:
-                print("WARNING: Owner role not found in role table, but continuing...")
-        elif 'global_role_id' in columns_lower:
-            role_col = columns_lower['global_role_id']
+        elif global_role_col:
+            role_col = global_role_col
             insert_cols.append(role_col)
-            cur.execute('SELECT id FROM role WHERE name = %s LIMIT 1', ('owner',))
-            role_result = cur.fetchone()
-            if role_result:
-                insert_vals.append(role_result[0])
-                placeholders.append('%s')
-                print(f"Using {role_col} with owner role ID: {role_result[0]}")
-            else:
-                print("WARNING: Owner role not found in role table, but continuing...")
+            # Resolve the owner role ID inside the INSERT itself
+            insert_vals.append('owner')
+            placeholders.append(sql.SQL(ROLE_ID_BY_NAME_SUBQUERY))
+            log.info("Using %s with the owner role ID", role_col)
         else:
-            print("WARNING: No role column found, user may not have proper permissions")
+            log.warning("No role column found, user may not have proper permissions")
         
         # Timestamps - case-insensitive
-        created_at_col = None
-        for col_variant in ['createdat', 'created_at']:
-            if col_variant in columns_lower:
-                created_at_col = columns_lower[col_variant]
-                break
+        created_at_col = find_column(columns_lower, 'createdat', 'created_at')
         
         if created_at_col:
-            # Use quotes if camelCase (contains uppercase letters)
-            if created_at_col != created_at_col.lower():
-                insert_cols.append(f'"{created_at_col}"')
-            else:
-                insert_cols.append(created_at_col)
-            insert_vals.append(now)
-            placeholders.append('%s')
+            insert_cols.append(created_at_col)
+            # Let the server fill in the timestamp
+            placeholders.append(NOW_SQL)
         
-        updated_at_col = None
-        for col_variant in ['updatedat', 'updated_at']:
-            if col_variant in columns_lower:
-                updated_at_col = columns_lower[col_variant]
-                break
+        updated_at_col = find_column(columns_lower, 'updatedat', 'updated_at')
         
         if updated_at_col:
-            # Use quotes if camelCase (contains uppercase letters)
-            if updated_at_col != updated_at_col.lower():
-                insert_cols.append(f'"{updated_at_col}"')
-            else:
-                insert_cols.append(updated_at_col)
-            insert_vals.append(now)
-            placeholders.append('%s')
+            insert_cols.append(updated_at_col)
+            # Let the server fill in the timestamp
+            placeholders.append(NOW_SQL)
         
-        # Build and execute the INSERT query
-        insert_query = f"""
-            INSERT INTO "user" (
-                {', '.join(insert_cols)}
-            ) VALUES (
-                {', '.join(placeholders)}
-            )
-        """
+        # Build and execute the INSERT query. ON CONFLICT makes the insert
+        # safe against another process creating the same user after our
+        # existence check above.
+        # Identifier quotes the real column names, camelCase included
+        insert_query = INSERT_USER_SQL.format(
+            columns=sql.SQL(', ').join(map(sql.Identifier, insert_cols)),
+            values=sql.SQL(', ').join(placeholders)
+        )
         
-        print(f"Executing INSERT with columns: {insert_cols}")
+        log.info("Executing INSERT with columns: %s", insert_cols)
         cur.execute(insert_query, insert_vals)
-        conn.commit()
+        # The shared connection is in autocommit mode, so the INSERT is
+        # its own transaction without a BEGIN/COMMIT round trip
+        inserted = cur.fetchone()
         
-        print(f"✓ Successfully created owner user '{DEFAULT_USER_EMAIL}' (ID: {user_id})")
-        print(f"  Email: {DEFAULT_USER_EMAIL}")
-        print(f"  Password: {DEFAULT_USER_PASSWORD}")
-        print(f"  Role: global:owner")
+        if inserted is None:
+            cur.execute(USER_ID_BY_EMAIL_SQL, (DEFAULT_USER_EMAIL,))
+            user_id = cur.fetchone()[0]
+            log.info("User '%s' was created concurrently (ID: %s)", DEFAULT_USER_EMAIL, user_id)
+            cur.close()
+            return user_id
+        
+        user_id = inserted[0]
+        log.info("✓ Successfully created owner user '%s' (ID: %s)", DEFAULT_USER_EMAIL, user_id)
+        log.info("  Email: %s", DEFAULT_USER_EMAIL)
+        log.info("  Password: %s", DEFAULT_USER_PASSWORD)
+        log.info("  Role: global:owner")
         
         cur.close()
-        conn.close()
         return user_id
 
     except psycopg2.Error as e:
-        print(f"Database error: {e}")
-        import traceback
-        traceback.print_exc()
+        log.error("Database error: %s", e)
+        log.debug("Traceback:", exc_info=True)
+        close_db_connection()
         return None
     except Exception as e:
-        print(f"Unexpected error: {e}")
-        import traceback
-        traceback.print_exc()
+        log.error("Unexpected error: %s", e)
+        log.debug("Traceback:", exc_info=True)
         return None
 
 
 def wait_for_n8n_api():
-    """Wait for n8n API to be ready."""
-    print("Waiting for n8n API to be ready...")
-    max_wait = 120
-    wait_interval = 3
-    
-    for i in range(max_wait // wait_interval):
+    """Wait for n8n API to be ready.
+
+    Polls until n8n answers or API_WAIT_CANCELLED is set. It runs in the
+    background during the database steps; main() applies API_WAIT_TIMEOUT
+    once the user exists.
+    """
+    log.info("Waiting for n8n API to be ready...")
+    attempt = 0
+    while True:
         try:
-            response = requests.get(f"{N8N_BASE_URL}/healthz", timeout=5)
+            response = HTTP_SESSION.get(f"{N8N_BASE_URL}/healthz", timeout=2)
             if response.status_code == 200:
-                print("n8n API is ready!")
+                log.info("n8n API is ready!")
                 return True
         except Exception:
             pass
         
-        if i < (max_wait // wait_interval) - 1:
-            print(f"Waiting for n8n API... (attempt {i+1})")
-            time.sleep(wait_interval)
-    
-    print("WARNING: n8n API might not be ready, but continuing...")
+        log.debug("Waiting for n8n API... (attempt %d)", attempt + 1)
+        if API_WAIT_CANCELLED.wait(backoff_delay(attempt)):
+            return False
+        attempt += 1
+
+
+def load_cached_session_cookie():
+    """Load cookies from the cookie file if it is younger than the TTL."""
+    try:
+        age = time.time() - os.path.getmtime(SESSION_COOKIE_FILE)
+        # Leave a safety margin so we never reuse a cookie about to expire
+        if age >= SESSION_COOKIE_TTL - 30:
+            return None
+        cookies = {}
+        with open(SESSION_COOKIE_FILE) as f:
+            for line in f:
+                name, sep, value = line.rstrip('\n').partition('=')
+                if sep:
+                    cookies[name] = value
+        return cookies or None
+    except OSError:
+        return None
+
+
+def save_session_cookie(cookies):
+    """Write cookies to SESSION_COOKIE_FILE as name=value lines.
+
+    The file is written under a temporary name and renamed into place, so
+    readers never see a partial file.
+    """
+    data = ''.join(f"{name}={value}\n" for name, value in cookies.items())
+    tmp_path = f"{SESSION_COOKIE_FILE}.tmp"
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(data)
+        os.replace(tmp_path, SESSION_COOKIE_FILE)
+    except BaseException:
+        # Don't leave a stale temporary file behind
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def cached_session_is_valid():
+    """Check whether the cached session cookie is still accepted by n8n.
+
+    GET /rest/login returns the current user for an authenticated session
+    and 401 otherwise, so it validates the cookie without logging in again.
+    """
+    cookies = load_cached_session_cookie()
+    if not cookies:
+        return False
+
+    HTTP_SESSION.cookies.update(cookies)
+    try:
+        response = HTTP_SESSION.get(f"{N8N_BASE_URL}/rest/login", timeout=5)
+        if response.status_code == 200:
+            return True
+    except requests.exceptions.RequestException:
+        pass
+
+    HTTP_SESSION.cookies.clear()
     return False
 
 
 def login_via_api():
     """Login via n8n API to create a proper session and get session cookie."""
     try:
-        print(f"Attempting to login via n8n API at {N8N_BASE_URL}...")
+        if cached_session_is_valid():
+            log.info("✓ Reusing cached session cookie from %s", SESSION_COOKIE_FILE)
+            return True
+
+        log.info("Attempting to login via n8n API at %s...", N8N_BASE_URL)
         
         # Login endpoint
         login_url = f"{N8N_BASE_URL}/rest/login"
@@ -334,163 +595,179 @@ def login_via_api():
             "password": DEFAULT_USER_PASSWORD
         }
         
-        # Use a session to maintain cookies
-        session = requests.Session()
-        response = session.post(login_url, json=payload, timeout=10)
+        # The shared session keeps the cookies n8n sets on login
+        # (connect, read): fail fast if n8n is unreachable, but give the
+        # password check time to finish
+        response = HTTP_SESSION.post(login_url, json=payload, timeout=(3, 10))
         
         if response.status_code == 200:
-            print("✓ Successfully logged in via API - session created!")
+            log.info("✓ Successfully logged in via API - session created!")
             # Get session cookie
-            cookies = session.cookies.get_dict()
+            cookies = HTTP_SESSION.cookies.get_dict()
             if cookies:
-                print(f"✓ Session cookie obtained: {list(cookies.keys())[0]}")
+                log.info("✓ Session cookie obtained: %s", list(cookies.keys())[0])
                 # Save cookie to file for potential use by reverse proxy
-                cookie_file = "/tmp/n8n_session_cookie.txt"
+                # and for reuse on the next run
                 try:
-                    with open(cookie_file, 'w') as f:
-                        for name, value in cookies.items():
-                            f.write(f"{name}={value}\n")
-                    print(f"✓ Session cookie saved to {cookie_file}")
+                    save_session_cookie(cookies)
+                    log.info("✓ Session cookie saved to %s", SESSION_COOKIE_FILE)
                 except Exception:
                     pass  # Ignore if we can't write to file
             return True
         elif response.status_code == 401:
-            print(f"⚠ Login failed - incorrect credentials or user setup issue")
+            log.warning("Login failed - incorrect credentials or user setup issue")
             return False
         else:
-            print(f"Note: API login returned status {response.status_code}")
+            log.info("Note: API login returned status %s", response.status_code)
             return True
             
     except requests.exceptions.ConnectionError:
-        print(f"Note: Could not connect to n8n API (n8n might still be starting)")
+        log.info("Note: Could not connect to n8n API (n8n might still be starting)")
         return True
     except Exception as e:
-        print(f"Note: API login skipped: {e}")
+        log.info("Note: API login skipped: %s", e)
         return True
 
 
-def wait_for_role_table():
-    """Wait for role table to exist (needed for user creation)."""
-    print("Waiting for role table to be available...")
-    max_wait = 60
-    wait_interval = 2
-    
-    for i in range(max_wait // wait_interval):
+def wait_for_schema():
+    """Wait for n8n to create the user and role tables.
+
+    Both tables are checked with a single query per attempt. Once the
+    user table exists, the role table gets at most ROLE_TABLE_WAIT_TIMEOUT
+    more, as it may be created later or not at all. Returns a
+    (user_table_ready, role_table_ready) tuple, or None on a database
+    error that retrying cannot fix.
+    """
+    log.info("Waiting for n8n to initialize database schema...")
+    deadline = time.monotonic() + SCHEMA_WAIT_TIMEOUT
+    user_ready = role_ready = False
+    role_grace_started = False
+    attempt = 0
+    while time.monotonic() < deadline:
         try:
-            conn = psycopg2.connect(
-                host=DB_HOST,
-                port=DB_PORT,
-                database=DB_NAME,
-                user=DB_USER,
-                password=DB_PASSWORD
-            )
-            cur = conn.cursor()
-            cur.execute("""
-                SELECT EXISTS (
-                    SELECT FROM information_schema.tables 
-                    WHERE table_name = 'role'
-                )
-            """)
-            if cur.fetchone()[0]:
-                cur.close()
-                conn.close()
-                return True
+            cur = get_db_connection().cursor()
+            cur.execute(SCHEMA_TABLES_EXIST_SQL)
+            user_ready, role_ready = cur.fetchone()
             cur.close()
-            conn.close()
-        except Exception:
-            pass
+            
+            if user_ready and role_ready:
+                log.info("Database schema is ready!")
+                break
+            if user_ready and not role_grace_started:
+                role_grace_started = True
+                deadline = time.monotonic() + ROLE_TABLE_WAIT_TIMEOUT
+                log.info("Waiting for role table to be available...")
+        except psycopg2.OperationalError as e:
+            close_db_connection()
+            # A reconnect may fail for reasons retrying cannot fix
+            if is_fatal_db_error(e):
+                log.error("Database configuration error: %s", e)
+                return None
+            log.debug("Error checking schema: %s", e)
+        except Exception as e:
+            log.debug("Error checking schema: %s", e)
+            # Reconnect on the next attempt
+            close_db_connection()
         
-        if i < (max_wait // wait_interval) - 1:
-            time.sleep(wait_interval)
+        log.debug("Schema not ready yet, waiting... (%d attempts)", attempt + 1)
+        time.sleep(backoff_delay(attempt))
+        attempt += 1
     
-    return False
+    return user_ready, role_ready
 
 
 def main():
     """Main function."""
-    print("=" * 50)
-    print("n8n Auto-Login Setup Script")
-    print("=" * 50)
+    # Retry attempts are logged at DEBUG; set LOG_LEVEL=DEBUG to see them
+    # An invalid LOG_LEVEL is reported by validate_config() below
+    level = log_level()
+    logging.basicConfig(
+        level=level if level is not None else logging.INFO,
+        format='%(asctime)s %(levelname)s %(message)s',
+        stream=sys.stdout
+    )
+    log.info("=" * 50)
+    log.info("n8n Auto-Login Setup Script")
+    log.info("=" * 50)
 
-    if not wait_for_database():
+    if not validate_config():
         sys.exit(1)
 
-    # Wait for n8n to initialize the database schema and be ready
-    print("Waiting for n8n to initialize database schema...")
-    max_schema_wait = 120  # Wait up to 120 seconds for schema
-    schema_wait_interval = 3
-    
-    schema_ready = False
-    for i in range(max_schema_wait // schema_wait_interval):
-        try:
-            conn = psycopg2.connect(
-                host=DB_HOST,
-                port=DB_PORT,
-                database=DB_NAME,
-                user=DB_USER,
-                password=DB_PASSWORD
-            )
-            cur = conn.cursor()
-            # Check if user table exists
-            cur.execute("""
-                SELECT EXISTS (
-                    SELECT FROM information_schema.tables 
-                    WHERE table_name = 'user'
-                )
-            """)
-            table_exists = cur.fetchone()[0]
-            
-            if table_exists:
-                print("Database schema is ready!")
-                schema_ready = True
-                cur.close()
-                conn.close()
-                break
-            
-            cur.close()
-            conn.close()
-        except Exception as e:
-            print(f"Error checking schema: {e}")
-        
-        if not schema_ready and i < (max_schema_wait // schema_wait_interval) - 1:
-            print(f"Schema not ready yet, waiting... ({i+1} attempts)")
-            time.sleep(schema_wait_interval)
-    
-    if not schema_ready:
-        print("WARNING: Schema might not be fully ready, but attempting to create user anyway...")
+    # The n8n API comes up independently of the database steps, so wait for
+    # it in parallel
+    executor = ThreadPoolExecutor(max_workers=1)
+    api_future = executor.submit(wait_for_n8n_api)
+    try:
+        if not wait_for_database():
+            sys.exit(1)
 
-    # Wait for role table
-    if not wait_for_role_table():
-        print("WARNING: Role table not found, but continuing...")
+        # Wait for n8n to initialize the database schema and be ready
+        schema_state = wait_for_schema()
+        if schema_state is None:
+            sys.exit(1)
+        user_table_ready, role_table_ready = schema_state
+        if not user_table_ready:
+            log.warning("Schema might not be fully ready, but attempting to create user anyway...")
+        if not role_table_ready:
+            log.warning("Role table not found, but continuing...")
 
-    # Create or get user
-    user_id = create_or_get_user()
-    
-    if not user_id:
-        print("=" * 50)
-        print("Failed to create/get user!")
-        print("=" * 50)
-        sys.exit(1)
-    
-    # Wait for n8n API and login to create session
-    wait_for_n8n_api()
-    login_via_api()
+        # Create or get user
+        user_id = create_or_get_user()
+        close_db_connection()
+        
+        if not user_id:
+            log.info("=" * 50)
+            log.error("Failed to create/get user!")
+            log.info("=" * 50)
+            sys.exit(1)
+        
+        # Wait for n8n API and login to create session. API_WAIT_TIMEOUT
+        # counts from here rather than from startup, since on a slow first
+        # boot the database steps alone can use it up.
+        try:
+            api_ready = api_future.result(timeout=API_WAIT_TIMEOUT)
+        except FutureTimeoutError:
+            api_ready = False
+        if not api_ready:
+            log.warning("n8n API might not be ready, but continuing...")
+        login_via_api()
+    finally:
+        # Stop the API poll on every exit path, otherwise the worker thread
+        # keeps the process alive until n8n answers
+        API_WAIT_CANCELLED.set()
+        executor.shutdown(wait=False)
     
-    print("=" * 50)
-    print("Initialization completed successfully!")
-    print(f"User: {DEFAULT_USER_EMAIL}")
-    print(f"Password: {DEFAULT_USER_PASSWORD}")
-    print("")
-    print("NOTE: For automatic login without login screen:")
-    print("- The user has been created in the database")
-    print("- When accessing n8n URL, you may need to login once")
-    print("- After first login, the session will persist")
-    print("- For true auto-login, consider using browser automation or")
-    print("  reverse proxy cookie injection")
-    print("=" * 50)
+    log.info("=" * 50)
+    log.info("Initialization completed successfully!")
+    log.info("User: %s", DEFAULT_USER_EMAIL)
+    log.info("Password: %s", DEFAULT_USER_PASSWORD)
+    log.info("NOTE: For automatic login without login screen:")
+    log.info("- The user has been created in the database")
+    log.info("- When accessing n8n URL, you may need to login once")
+    log.info("- After first login, the session will persist")
+    log.info("- For true auto-login, consider using browser automation or")
+    log.info("  reverse proxy cookie injection")
+    log.info("=" * 50)
     sys.exit(0)
 
 
 if __name__ == "__main__":
+    # Unknown arguments (e.g. a mistyped option) exit with status 2 instead
+    # of falling through to the database setup
+    parser = argparse.ArgumentParser(description=__doc__.strip(), allow_abbrev=False)
+    parser.add_argument(
+        '--print-password-hash',
+        action='store_true',
+        help='print a bcrypt hash of N8N_DEFAULT_PASSWORD for '
+             'N8N_DEFAULT_PASSWORD_HASH and exit'
+    )
+    args = parser.parse_args()
+    if args.print_password_hash:
+        # Generate a value for N8N_DEFAULT_PASSWORD_HASH once, so container
+        # starts can skip bcrypt entirely
+        if not validate_config():
+            sys.exit(1)
+        print(hash_password(DEFAULT_USER_PASSWORD))
+        sys.exit(0)
     main()
 